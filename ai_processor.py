@@ -1,38 +1,101 @@
 import os
+import asyncio
+import hashlib
+import inspect
+import json
+import logging
+import functools
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+import diskcache
 from dotenv import load_dotenv
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+# Optional: faster JSON serialization for the cache keys
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: paraphrase-aware response cache
+try:
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    semantic_cache_available = True
+except ImportError:
+    semantic_cache_available = False
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Per-request diagnostics are logged at DEBUG; set LOG_LEVEL=DEBUG to see them.
+# Only this module's logger is configured, root logging is left to the app.
+logger = logging.getLogger(__name__)
+_log_level = logging.getLevelName(os.getenv("LOG_LEVEL", "WARNING").upper())
+if not isinstance(_log_level, int): # Unknown names come back as "Level <name>"
+    _log_level = logging.WARNING
+logger.setLevel(_log_level)
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+    logger.addHandler(_log_handler)
+    logger.propagate = False # Don't print twice if the app also configures the root logger
+
+# Static instructions, sent as the model's system instruction instead of with every prompt
+SYSTEM_INSTRUCTION = (
+    "Rol: analista de encuestas sobre el bienestar de personas mayores.\n"
+    "Reglas:\n"
+    "- Usa SOLO los datos de la encuesta.\n"
+    "- Si los datos no bastan, dilo.\n"
+    "- Responde en español."
+)
+
+def _supports_system_instruction(model_name: str) -> bool:
+    """gemini-1.0 models (including the gemini-pro alias) reject system instructions."""
+    name = model_name.removeprefix("models/")
+    return not (name == "gemini-pro" or name.startswith("gemini-1.0"))
+
+def _create_model(model_name: str):
+    """Builds the Gemini model, attaching SYSTEM_INSTRUCTION when the model supports it."""
+    if _supports_system_instruction(model_name):
+        return genai.GenerativeModel(model_name, system_instruction=SYSTEM_INSTRUCTION)
+    return genai.GenerativeModel(model_name)
+
+# Model selection. Set GEMINI_MODEL to override; if the preferred model turns out not to be
+# available, the first request falls back to FALLBACK_MODEL_NAME and saves that choice.
+DEFAULT_MODEL_NAME = "gemini-1.5-pro"
+FALLBACK_MODEL_NAME = "gemini-pro"
+MODEL_CHOICE_FILE = '.model_choice'
+
+def _preferred_model_name() -> str:
+    """Returns GEMINI_MODEL if set, else the model saved by an earlier fallback, else DEFAULT_MODEL_NAME."""
+    env_model_name = os.getenv("GEMINI_MODEL")
+    if env_model_name:
+        return env_model_name
+    try:
+        with open(MODEL_CHOICE_FILE, 'r', encoding='utf-8') as f:
+            saved_model_name = f.read().strip()
+        if saved_model_name:
+            return saved_model_name
+    except OSError:
+        pass
+    return DEFAULT_MODEL_NAME
+
 # Initialize the Google Gemini client
+# No genai.list_models() here: it is a network call that would block Streamlit startup.
 google_api_key_loaded = False
 gemini_model = None
 try:
     google_api_key = os.getenv("GOOGLE_API_KEY")
     if google_api_key:
         genai.configure(api_key=google_api_key)
-        
-        # List available models to see which ones are supported
-        try:
-            models = genai.list_models()
-            print("Available models:")
-            gemini_models = [m for m in models if "gemini" in m.name.lower()]
-            for model in gemini_models:
-                print(f"- {model.name}")
-            
-            # Use gemini-1.5-pro or fallback to gemini-pro if available
-            model_name = "gemini-1.5-pro" if any("gemini-1.5-pro" in m.name for m in gemini_models) else "gemini-pro"
-            gemini_model = genai.GenerativeModel(model_name)
-            google_api_key_loaded = True
-            print(f"Google Gemini client configured and model initialized ({model_name}).")
-        except Exception as e:
-            print(f"Error listing models: {e}")
-            # Fallback to default model name
-            model_name = "gemini-pro"
-            gemini_model = genai.GenerativeModel(model_name)
-            google_api_key_loaded = True
-            print(f"Google Gemini client configured with fallback model ({model_name}).")
+        model_name = _preferred_model_name()
+        gemini_model = _create_model(model_name)
+        google_api_key_loaded = True
+        print(f"Google Gemini client configured and model initialized ({model_name}).")
     else:
         print("Error: GOOGLE_API_KEY not found in .env file or environment variables.")
         print("Please ensure your .env file is set up correctly with GOOGLE_API_KEY=\"your_key\"")
@@ -41,101 +104,468 @@ except Exception as e:
     print(f"Error initializing Google Gemini client: {e}")
     print("Please ensure your GOOGLE_API_KEY is correctly set in your .env file and is valid.")
 
-def get_ai_response(question: str, sheet_data: list, model_name=None): # model_name param kept for backward compatibility
+def _is_fallback_model(model_name: str) -> bool:
+    """Returns whether model_name (with or without the models/ prefix) is FALLBACK_MODEL_NAME."""
+    return model_name.removeprefix("models/") == FALLBACK_MODEL_NAME
+
+def _fall_back_model():
+    """
+    Switches to FALLBACK_MODEL_NAME and saves the choice so later starts use it directly.
+    Does nothing if another request already switched.
+    """
+    global gemini_model
+    if _is_fallback_model(gemini_model.model_name):
+        return
+    logger.warning("Model %s not available, falling back to %s.", gemini_model.model_name, FALLBACK_MODEL_NAME)
+    gemini_model = _create_model(FALLBACK_MODEL_NAME)
+    try:
+        with open(MODEL_CHOICE_FILE, 'w', encoding='utf-8') as f:
+            f.write(FALLBACK_MODEL_NAME)
+    except OSError as e:
+        logger.warning("Error saving model choice: %s", e)
+
+GENERATION_CONFIG = {
+    "temperature": 0.2,  # Lower temperature for more deterministic responses
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
+]
+
+# Response cache: the same question against the same data is answered without calling Gemini.
+# Stored on disk so cached answers survive Streamlit restarts.
+CACHE_DIR = '.ai_cache'
+CACHE_SIZE_LIMIT = 64 << 20 # 64 MB
+CACHE_TTL_SECONDS = 86400
+CACHE_MAX_TEMPERATURE = 0.3 # Above this, answers vary too much between calls to be reused
+_response_cache = diskcache.Cache(CACHE_DIR, size_limit=CACHE_SIZE_LIMIT, eviction_policy='least-recently-used')
+_cache_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock() # Async lookups update the counters from worker threads
+
+def _hash_json(payload) -> str:
+    """Returns the sha256 hex digest of payload serialized as JSON."""
+    if orjson:
+        return hashlib.sha256(orjson.dumps(payload)).hexdigest()
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode("utf-8")).hexdigest()
+
+def _cache_key(model_name: str, question: str, context_rows: tuple) -> str:
+    """Hashes the model name, the question and the rows that end up in the prompt."""
+    return _hash_json([model_name, question, context_rows])
+
+# Semantic cache: a paraphrased question about the same data reuses the cached answer.
+# Only active when sentence-transformers is installed.
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+SEMANTIC_CACHE_THRESHOLD = 0.92
+_embedder = None
+_embedder_lock = threading.Lock()
+SEMANTIC_INDEX_MAX_ENTRIES = 1000
+_emb_index = OrderedDict() # response cache key -> (normalized question embedding, data hash), oldest first
+_emb_index_lock = threading.Lock() # Batch lookups and stores run on different threads
+
+def _data_hash(model_name: str, data_rows: tuple) -> str:
+    """Hashes the model name and the full-width rows selected for the prompt, which don't depend on the question."""
+    return _hash_json([model_name, data_rows])
+
+@functools.lru_cache(maxsize=64)
+def _encode_question(question: str):
+    """Embeds the question, loading the embedding model on first use. Memoized for prefetching."""
+    global _embedder
+    with _embedder_lock: # The app may embed from a background thread while the main one does too
+        if _embedder is None:
+            _embedder = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _embedder.encode(question, normalize_embeddings=True)
+
+def _embed_question(question: str):
+    """Returns the L2-normalized embedding of the question, or None if it can't be computed."""
+    try:
+        return _encode_question(question)
+    except Exception as e:
+        logger.warning("Error computing question embedding: %s", e)
+        return None
+
+def prefetch_question_embedding(question: str):
+    """
+    Loads the embedding model and embeds the question ahead of the AI call,
+    so the semantic cache lookup in get_ai_response doesn't wait for it.
+    """
+    if semantic_cache_available and question.strip():
+        _embed_question(question)
+
+def _semantic_lookup(question_embedding, data_hash: str):
+    """Returns the cached response of the most similar earlier question on the same data, if similar enough."""
+    with _emb_index_lock:
+        candidates = [(vec, key) for key, (vec, entry_hash) in _emb_index.items() if entry_hash == data_hash]
+    if not candidates:
+        return None
+    # Embeddings are normalized, so the dot product is the cosine similarity
+    similarities = np.stack([vec for vec, _ in candidates]) @ question_embedding
+    best = int(np.argmax(similarities))
+    if similarities[best] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    best_key = candidates[best][1]
+    cached_response = _response_cache.get(best_key)
+    if cached_response is None: # Expired or evicted from the response cache
+        with _emb_index_lock:
+            _emb_index.pop(best_key, None)
+    return cached_response
+
+def cache_stats() -> dict:
+    """Returns the response cache hit and miss counts since startup."""
+    with _stats_lock:
+        return dict(_cache_stats)
+
+# Prompt data budget: rows are added until the estimated size reaches MAX_CONTEXT_TOKENS
+MAX_CONTEXT_TOKENS = 2000
+CHARS_PER_TOKEN = 4 # Rough estimate, avoids a count_tokens round-trip per call
+WIDE_SHEET_MIN_COLUMNS = 10 # From this width on, only columns mentioned in the question are sent
+
+def _normalize_words(text: str) -> set:
+    """Lowercases, strips accents and splits text into words."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return set(re.findall(r"\w+", text))
+
+# Words too common in Spanish questions and survey headers to say which column a question is about
+# (accents stripped, as produced by _normalize_words)
+COLUMN_MATCH_STOP_WORDS = {
+    "como", "cual", "cuales", "cuando", "cuanto", "cuanta", "cuantos", "cuantas", "donde", "quien", "quienes",
+    "para", "porque", "pero", "sobre", "entre", "desde", "hasta", "durante", "segun", "tambien", "solo",
+    "esta", "este", "esto", "estas", "estos", "esas", "esos", "aquel", "otro", "otra", "otros", "otras",
+    "todo", "toda", "todos", "todas", "algo", "alguna", "alguno", "algunas", "algunos", "cada", "mucho",
+    "mucha", "muchos", "muchas", "poco", "menos", "usted", "ustedes", "ellos", "ellas", "nuestro", "nuestra",
+    "hubo", "habia", "haya", "hace", "hacer", "tiene", "tienen", "tuvo", "sido", "estan", "eres", "fueron",
+    "general", "persona", "personas", "mayor", "mayores", "encuesta", "pregunta", "respuesta",
+}
+
+def _relevant_columns(header: list, question: str):
+    """
+    On wide sheets, returns the indices of the first column (the timestamp) plus the columns
+    whose header shares a meaningful word (4+ letters, not a stop word) with the question.
+    Returns None to keep every column, including when nothing meaningful matches.
+    """
+    if len(header) < WIDE_SHEET_MIN_COLUMNS:
+        return None
+    question_words = {
+        word for word in _normalize_words(question)
+        if len(word) >= 4 and word not in COLUMN_MATCH_STOP_WORDS
+    }
+    columns = [i for i, title in enumerate(header) if i > 0 and question_words & _normalize_words(str(title))]
+    return [0] + columns if columns else None
+
+def _select_context_rows(question: str, sheet_data: list) -> tuple:
+    """
+    Picks the rows sent to Gemini: the header, then data rows until MAX_CONTEXT_TOKENS is reached.
+    Narrow sheets get more rows and wide sheets fewer, instead of a fixed count. The budget is
+    measured on full rows so the selection doesn't depend on the question; on wide sheets the
+    selected rows are then narrowed to the columns the question is about.
+
+    Args:
+        question (str): The user's question, used to pick columns on wide sheets.
+        sheet_data (list): The data from the Google Sheet (list of lists).
+
+    Returns:
+        tuple: (data_rows, context_rows), both tuples of tuples (hashable). data_rows has every
+            column and is the same for any question (semantic cache data hash); context_rows is
+            what goes into the prompt (_build_context and the exact cache key).
+    """
+    if not sheet_data:
+        return (), ()
+    budget = MAX_CONTEXT_TOKENS * CHARS_PER_TOKEN
+    data_rows = []
+    for row in sheet_data:
+        row = tuple(map(str, row))
+        row_chars = sum(len(cell) + 2 for cell in row) # Cells plus the ", " separators
+        if data_rows and row_chars > budget: # The header is always kept
+            break
+        budget -= row_chars
+        data_rows.append(row)
+    data_rows = tuple(data_rows)
+
+    columns = _relevant_columns(data_rows[0], question)
+    if columns is None:
+        return data_rows, data_rows
+    context_rows = tuple(tuple(row[i] if i < len(row) else "" for i in columns) for row in data_rows)
+    return data_rows, context_rows
+
+@functools.lru_cache(maxsize=8)
+def _build_context(rows: tuple) -> str:
+    """
+    Formats the survey rows as the data section of the prompt.
+    Memoized so follow-up questions on the same data skip rebuilding it.
+
+    Args:
+        rows (tuple): Header row followed by data rows, as a tuple of tuples (hashable).
+
+    Returns:
+        str: The data context block of the prompt.
+    """
+    if not rows:
+        return "Datos de la encuesta:\nNo hay datos disponibles de la encuesta.\n\n---\n"
+    # One join over all non-empty rows (header included) instead of repeated string concatenation
+    lines = [", ".join(map(str, row)) for row in rows if row]
+    return "\n".join(["Datos de la encuesta:", *lines, "", "---", ""])
+
+def _lookup_cache(question: str, data_rows: tuple, context_rows: tuple, force_refresh: bool):
+    """
+    Looks the question up in the exact cache (keyed by the prompt rows), then in the
+    semantic cache (guarded by the hash of the full-width rows, see _select_context_rows).
+
+    Returns:
+        tuple: (cached_response, cache_entry). cached_response is None on a miss.
+            cache_entry is what _store_cache needs to save the fresh answer, or None if caching is disabled.
+    """
+    if GENERATION_CONFIG["temperature"] > CACHE_MAX_TEMPERATURE:
+        return None, None
+
+    model_name = gemini_model.model_name
+    question_embedding = None
+    cached_response = None if force_refresh else _response_cache.get(_cache_key(model_name, question, context_rows))
+    if cached_response is None and semantic_cache_available:
+        data_hash = _data_hash(model_name, data_rows)
+        question_embedding = _embed_question(question)
+        if question_embedding is not None and not force_refresh:
+            cached_response = _semantic_lookup(question_embedding, data_hash)
+
+    with _stats_lock:
+        _cache_stats["hits" if cached_response is not None else "misses"] += 1
+    return cached_response, (question, data_rows, context_rows, question_embedding)
+
+def _store_cache(cache_entry, model_name: str, response_text: str):
+    """
+    Saves a fresh answer for the entry returned by _lookup_cache. The keys are computed
+    from model_name, the model that actually answered, which differs from the one used
+    for the lookup if the call fell back to another model.
+    """
+    if cache_entry is None or not response_text:
+        return
+    question, data_rows, context_rows, question_embedding = cache_entry
+    cache_key = _cache_key(model_name, question, context_rows)
+    data_hash = _data_hash(model_name, data_rows)
+    _response_cache.set(cache_key, response_text, expire=CACHE_TTL_SECONDS)
+    if question_embedding is not None:
+        with _emb_index_lock:
+            _emb_index[cache_key] = (question_embedding, data_hash)
+            _emb_index.move_to_end(cache_key)
+            while len(_emb_index) > SEMANTIC_INDEX_MAX_ENTRIES:
+                _emb_index.popitem(last=False)
+
+def _build_prompt(model_name: str, data_context: str, question: str) -> str:
+    """Builds the prompt for the given model; the instructions travel as system instruction when supported."""
+    full_prompt = f"{data_context}Pregunta del usuario: {question}"
+    if not _supports_system_instruction(model_name):
+        full_prompt = f"{SYSTEM_INSTRUCTION}\n\n{full_prompt}"
+    return full_prompt
+
+def _with_model_fallback(func):
+    """
+    Decorator for the functions that call Gemini, which get the model to call as first argument.
+    If that model is not found, switch to the fallback model and retry once on it. The decision
+    depends on the model the failed call used, so requests already in flight when another one
+    switched still retry; only a failure of the fallback model itself is raised.
+    Supports plain and async functions.
+    """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            model = gemini_model
+            try:
+                return await func(model, *args, **kwargs)
+            except google_exceptions.NotFound:
+                if _is_fallback_model(model.model_name):
+                    raise
+                _fall_back_model()
+                return await func(gemini_model, *args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        model = gemini_model
+        try:
+            return func(model, *args, **kwargs)
+        except google_exceptions.NotFound:
+            if _is_fallback_model(model.model_name):
+                raise
+            _fall_back_model()
+            return func(gemini_model, *args, **kwargs)
+    return wrapper
+
+def _gemini_guard(func):
+    """
+    Decorator for the public response functions: any error is logged and returned
+    (or yielded) as the Spanish error message. Supports generator and async functions.
     """
-    Gets a response from Google Gemini API based on the question and sheet data.
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def generator_wrapper(*args, **kwargs):
+            try:
+                yield from func(*args, **kwargs)
+            except Exception as e:
+                yield _error_message(e)
+        return generator_wrapper
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                return _error_message(e)
+        return async_wrapper
+
+    raise TypeError(f"_gemini_guard supports generator and async functions, not {func.__qualname__}")
+
+def _error_message(e: Exception) -> str:
+    """Logs a Gemini error and returns the Spanish message shown to the user."""
+    logger.error("Error communicating with Google Gemini: %s", e)
+    return f"Error al comunicar con Google Gemini: {e}"
+
+@_with_model_fallback
+def _stream_content(model, data_context: str, question: str):
+    """Sends the prompt to the model and returns (name of the model used, streaming response)."""
+    full_prompt = _build_prompt(model.model_name, data_context, question)
+    logger.debug("Sending to Google Gemini (model: %s), prompt length: %d characters", model.model_name, len(full_prompt))
+    return model.model_name, model.generate_content(
+        full_prompt,
+        generation_config=GENERATION_CONFIG,
+        safety_settings=SAFETY_SETTINGS,
+        stream=True
+    )
+
+@_gemini_guard
+def get_ai_response(question: str, sheet_data: list, model_name=None, force_refresh: bool = False): # model_name param kept for backward compatibility
+    """
+    Streams a response from Google Gemini API based on the question and sheet data.
+    A cached answer is yielded as a single chunk.
 
     Args:
         question (str): The user's question in Spanish.
         sheet_data (list): The data from the Google Sheet (list of lists).
         model_name (str): Not used anymore, the model is initialized globally.
+        force_refresh (bool): Skip the cached response and ask Gemini again.
+
+    Yields:
+        str: Chunks of the AI's response in Spanish, or an error message.
+    """
+    if not google_api_key_loaded or gemini_model is None:
+        yield "Error: El cliente de Google Gemini no está inicializado correctamente. Verifica la clave API."
+        return
+
+    # Header plus as many data rows as fit in the token budget
+    data_rows, context_rows = _select_context_rows(question, sheet_data)
+    cached_response, cache_entry = _lookup_cache(question, data_rows, context_rows, force_refresh)
+    if cached_response is not None:
+        logger.debug("Returning cached Google Gemini response")
+        yield cached_response
+        return
+
+    chunks = []
+    answered_by, response = _stream_content(_build_context(context_rows), question)
+    for chunk in response:
+        chunk_text = chunk.text
+        chunks.append(chunk_text)
+        yield chunk_text
+    response_text = "".join(chunks)
+    logger.debug("Received from Google Gemini: %d characters", len(response_text))
+    _store_cache(cache_entry, answered_by, response_text)
+
+def get_ai_response_blocking(question: str, sheet_data: list, force_refresh: bool = False) -> str:
+    """
+    Gets the complete response from Google Gemini API. See get_ai_response.
 
     Returns:
         str: The AI's response in Spanish, or an error message.
     """
-    if not google_api_key_loaded or gemini_model is None:
-        return "Error: El cliente de Google Gemini no está inicializado correctamente. Verifica la clave API."
+    return "".join(get_ai_response(question, sheet_data, force_refresh=force_refresh))
 
-    try:
-        data_context = "Datos de la encuesta:\n"
-        if sheet_data:
-            # Include header row
-            if sheet_data[0]: # Check if header row is not empty
-                 data_context += ", ".join(map(str, sheet_data[0])) + "\n" 
-            # Include up to 5 data rows for MVP to keep the prompt concise
-            for row in sheet_data[1:6]: # Start from the second row (actual data)
-                if row: # Check if row is not empty
-                    data_context += ", ".join(map(str, row)) + "\n"
-        else:
-            data_context += "No hay datos disponibles de la encuesta.\n"
-        data_context += "\n---\n"
-        
-        # Construct the prompt for Gemini
-        full_prompt = (
-            "Eres un asistente de IA que ayuda a analizar datos de encuestas sobre el bienestar de personas mayores. "
-            "Responde a las preguntas basándote ÚNICAMENTE en los datos de la encuesta proporcionados. "
-            "Si la respuesta no se encuentra en los datos, indica que no tienes suficiente información basada en los datos proporcionados. "
-            "Responde en ESPAÑOL.\n\n"
-            f"{data_context}"
-            f"Pregunta del usuario: {question}"
-        )
+# Async transport: a single long-lived event loop in a background thread owns the SDK's
+# grpc.aio channel, so concurrent requests are multiplexed over one connection instead of
+# each opening its own. (grpc.aio channels are bound to the loop that created them, which
+# is why asyncio.run() per call would not work here.)
+MAX_CONCURRENT_REQUESTS = 8
+_async_loop = None
+_async_loop_lock = threading.Lock()
+_request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
 
-        print(f"\n--- Sending to Google Gemini (model: {gemini_model.model_name}) --- ")
-        print(f"Full Prompt (partial data context): {full_prompt[:600]}...") # Print a snippet
-        print("------------------------------------")
-
-        # Generate content with updated configuration
-        generation_config = {
-            "temperature": 0.2,  # Lower temperature for more deterministic responses
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-        }
-        
-        safety_settings = [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
-        ]
-        
-        response = gemini_model.generate_content(
+def _get_async_loop():
+    """Returns the shared event loop, starting its thread on first use."""
+    global _async_loop
+    with _async_loop_lock:
+        if _async_loop is None:
+            _async_loop = asyncio.new_event_loop()
+            threading.Thread(target=_async_loop.run_forever, name="gemini-async", daemon=True).start()
+    return _async_loop
+
+def _run_async(coro):
+    """Runs a coroutine on the shared event loop from synchronous code and returns its result."""
+    return asyncio.run_coroutine_threadsafe(coro, _get_async_loop()).result()
+
+@_with_model_fallback
+async def _generate_async(model, data_context: str, question: str):
+    """Sends the prompt to the model over the async transport and returns (name of the model used, complete response)."""
+    full_prompt = _build_prompt(model.model_name, data_context, question)
+    logger.debug("Sending to Google Gemini async (model: %s), prompt length: %d characters", model.model_name, len(full_prompt))
+    async with _request_semaphore:
+        return model.model_name, await model.generate_content_async(
             full_prompt,
-            generation_config=generation_config,
-            safety_settings=safety_settings
+            generation_config=GENERATION_CONFIG,
+            safety_settings=SAFETY_SETTINGS
         )
-        
-        # Extract text from response
-        if hasattr(response, 'text'):
-            response_text = response.text
-        else:
-            # Fallback for different response structure
-            response_text = ""
-            if hasattr(response, 'parts'):
-                for part in response.parts:
-                    if hasattr(part, 'text'):
-                        response_text += part.text
-            elif hasattr(response, 'candidates') and response.candidates:
-                for candidate in response.candidates:
-                    if hasattr(candidate, 'content') and hasattr(candidate.content, 'parts'):
-                        for part in candidate.content.parts:
-                            if hasattr(part, 'text'):
-                                response_text += part.text
-
-        print("\n--- Received from Google Gemini --- ")
-        print(response_text)
-        print("---------------------------------")
-        return response_text
 
-    except Exception as e:
-        print(f"Error communicating with Google Gemini: {e}")
-        # Attempt to get more specific error details if available
-        error_details = ""
-        if hasattr(e, 'message'): # For google.api_core.exceptions
-            error_details = e.message
-        elif hasattr(e, 'args') and e.args: # General exception arguments
-            error_details = str(e.args[0])
-        return f"Error al comunicar con Google Gemini: {str(e)} ({error_details})"
+@_gemini_guard
+async def get_ai_response_async(question: str, sheet_data: list, force_refresh: bool = False) -> str:
+    """
+    Gets the complete response from Google Gemini API without blocking the event loop.
+    Must run on the shared loop (see _run_async). See get_ai_response.
+
+    Returns:
+        str: The AI's response in Spanish, or an error message.
+    """
+    if not google_api_key_loaded or gemini_model is None:
+        return "Error: El cliente de Google Gemini no está inicializado correctamente. Verifica la clave API."
+
+    data_rows, context_rows = _select_context_rows(question, sheet_data)
+    # The semantic lookup embeds the question (CPU bound), so keep it off the event loop
+    cached_response, cache_entry = await asyncio.to_thread(_lookup_cache, question, data_rows, context_rows, force_refresh)
+    if cached_response is not None:
+        logger.debug("Returning cached Google Gemini response")
+        return cached_response
+
+    answered_by, response = await _generate_async(_build_context(context_rows), question)
+    response_text = response.text
+    logger.debug("Received from Google Gemini: %d characters", len(response_text))
+    _store_cache(cache_entry, answered_by, response_text)
+    return response_text
+
+async def _gather_responses(questions: list, sheet_data: list, force_refresh: bool) -> list:
+    """Answers all questions concurrently, keeping their order."""
+    return await asyncio.gather(*(
+        get_ai_response_async(question, sheet_data, force_refresh=force_refresh) for question in questions
+    ))
+
+def get_ai_responses_batch(questions: list, sheet_data: list, force_refresh: bool = False) -> list:
+    """
+    Answers several questions about the same sheet data.
+    Cached questions are answered locally; the rest are sent to Gemini concurrently over
+    the shared async transport (at most MAX_CONCURRENT_REQUESTS at a time), reusing the
+    memoized data context.
+
+    Args:
+        questions (list): The user's questions in Spanish.
+        sheet_data (list): The data from the Google Sheet (list of lists).
+        force_refresh (bool): Skip the cached responses and ask Gemini again.
+
+    Returns:
+        list: The AI's response (or an error message) for each question, in order.
+    """
+    if not questions:
+        return []
+    return _run_async(_gather_responses(questions, sheet_data, force_refresh))
 
 # Example usage (for testing this script directly)
 if __name__ == '__main__':
@@ -154,15 +584,15 @@ if __name__ == '__main__':
         sample_question_spanish = "¿Cuál es el estado de ánimo general reportado y qué problemas hubo con servicios municipales?"
         
         print(f"\nTest Question (Spanish): {sample_question_spanish}")
-        ai_answer = get_ai_response(sample_question_spanish, sample_sheet_data)
+        ai_answer = get_ai_response_blocking(sample_question_spanish, sample_sheet_data)
         print(f"\nTest AI Answer (Spanish):\n{ai_answer}")
 
         sample_question_no_info = "¿Cuántas citas médicas se cancelaron?"
         print(f"\nTest Question No Info (Spanish): {sample_question_no_info}")
-        ai_answer_no_info = get_ai_response(sample_question_no_info, sample_sheet_data)
+        ai_answer_no_info = get_ai_response_blocking(sample_question_no_info, sample_sheet_data)
         print(f"\nTest AI Answer No Info (Spanish):\n{ai_answer_no_info}")
 
         # Test with empty sheet data
         print(f"\nTest Question with Empty Data (Spanish): {sample_question_spanish}")
-        ai_answer_empty_data = get_ai_response(sample_question_spanish, [])
+        ai_answer_empty_data = get_ai_response_blocking(sample_question_spanish, [])
         print(f"\nTest AI Answer with Empty Data (Spanish):\n{ai_answer_empty_data}") 
\ No newline at end of file
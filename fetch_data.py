@@ -3,71 +3,109 @@ import json
 import sys
 import os
 
+try:
+    import orjson # Faster JSON parsing/serialization; the standard json module is used without it
+except ImportError:
+    orjson = None
+
 SCOPE = [
     'https://www.googleapis.com/auth/spreadsheets',
     'https://www.googleapis.com/auth/drive.file'
 ]
 CREDENTIALS_FILE = 'credentials/credentials.json'
 SPREADSHEET_ID = '1p5KpYbewyBt6mHVp8Jxgkq9t0Y4tPyLtSaEa4BU_-n4'
-OUTPUT_FILE = 'temp_sheet_data.json'
 
-def fetch_and_save_data():
+# Authenticated client and worksheet handle, reused across fetches in the same process
+_gc = None
+_worksheet = None
+
+def _create_client():
+    """Authenticates with the service account from GCP_CREDENTIALS_JSON, or from CREDENTIALS_FILE if unset."""
+    gcp_credentials_json_str = os.getenv("GCP_CREDENTIALS_JSON")
+    if not gcp_credentials_json_str:
+        return gspread.service_account(filename=CREDENTIALS_FILE, scopes=SCOPE)
+    try:
+        credentials_dict = orjson.loads(gcp_credentials_json_str) if orjson else json.loads(gcp_credentials_json_str)
+        return gspread.service_account_from_dict(credentials_dict, scopes=SCOPE)
+    except json.JSONDecodeError as e: # orjson.JSONDecodeError is a subclass
+        raise RuntimeError("GCP_CREDENTIALS_JSON environment variable is not valid JSON.") from e
+    except Exception as e_env_load: # Catch other potential errors from service_account_from_dict
+        raise RuntimeError(f"Error loading credentials from env var: {e_env_load}") from e_env_load
+
+def _get_worksheet():
+    """Returns the cached sheet1 handle, authenticating and opening the spreadsheet on first use."""
+    global _gc, _worksheet
+    if _worksheet is None:
+        if _gc is None:
+            _gc = _create_client()
+        _worksheet = _gc.open_by_key(SPREADSHEET_ID).sheet1
+    return _worksheet
+
+def refresh_client():
+    """Drops the cached client and worksheet so the next fetch authenticates again."""
+    global _gc, _worksheet
+    _gc = None
+    _worksheet = None
+
+def _read_values(worksheet, max_rows):
+    """Reads the first max_rows rows of the worksheet, or all of them if max_rows is None."""
+    if max_rows is None:
+        return worksheet.get_all_values()
+    # Bounded values.get call: only the requested rows are transferred
+    return [list(row) for row in worksheet.get(f'A1:ZZ{max_rows}')]
+
+def fetch_sheet_values(max_rows=None):
     """
-    Accesses the Google Sheet, fetches all data, and saves it to a JSON file.
-    Prints success or error messages to stdout/stderr.
-    Exits with 0 on success, 1 on failure.
+    Accesses the Google Sheet and returns its rows.
+
+    Args:
+        max_rows (int): Number of rows to fetch, header included. Callers pick the count
+            (the app fetches one preview page at a time). None fetches the whole sheet.
+
+    Returns:
+        list: The sheet rows as a list of lists of strings (empty if the sheet is empty).
+
+    Raises:
+        RuntimeError: If the credentials can't be loaded or the sheet can't be read.
     """
-    gc = None
     try:
-        gcp_credentials_json_str = os.getenv("GCP_CREDENTIALS_JSON")
-        if gcp_credentials_json_str:
-            # print("fetch_data.py: Attempting to load credentials from GCP_CREDENTIALS_JSON env var...")
-            try:
-                credentials_dict = json.loads(gcp_credentials_json_str)
-                gc = gspread.service_account_from_dict(credentials_dict, scopes=SCOPE)
-                # print("fetch_data.py: Successfully loaded credentials from env var.")
-            except json.JSONDecodeError:
-                sys.stderr.write("fetch_data.py: Error: GCP_CREDENTIALS_JSON environment variable is not valid JSON.\n")
-                sys.exit(1)
-            except Exception as e_env_load: # Catch other potential errors from service_account_from_dict
-                sys.stderr.write(f"fetch_data.py: Error loading credentials from env var: {e_env_load}\n")
-                sys.exit(1)
-        else:
-            # print(f"fetch_data.py: GCP_CREDENTIALS_JSON env var not found. Falling back to file: {CREDENTIALS_FILE}")
-            gc = gspread.service_account(filename=CREDENTIALS_FILE, scopes=SCOPE)
-            # print("fetch_data.py: Successfully loaded credentials from file.")
+        try:
+            all_values = _read_values(_get_worksheet(), max_rows)
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code != 401:
+                raise
+            # Expired or revoked credentials: authenticate again and retry once
+            refresh_client()
+            all_values = _read_values(_get_worksheet(), max_rows)
+        return all_values or [] # Ensure it's an empty list if the sheet is empty
 
-        # print(f"fetch_data.py: Attempting to open spreadsheet by ID: {SPREADSHEET_ID}...")
-        spreadsheet = gc.open_by_key(SPREADSHEET_ID)
-        # print("fetch_data.py: Successfully opened spreadsheet by ID.")
-        
-        # print("fetch_data.py: Attempting to select sheet1...")
-        worksheet = spreadsheet.sheet1
-        # print("fetch_data.py: Successfully selected sheet1.")
-        
-        # print("fetch_data.py: Attempting worksheet.get_all_values()...")
-        all_values = worksheet.get_all_values()
-        # print("fetch_data.py: Successfully called worksheet.get_all_values().")
-        
-        if not all_values:
-            # print("fetch_data.py: Warning: No data found in the sheet, or sheet is empty.")
-            all_values = [] # Ensure it's an empty list for JSON
+    except RuntimeError:
+        raise
+    except FileNotFoundError as e:
+        raise RuntimeError(f"Credentials file not found at {CREDENTIALS_FILE}") from e
+    except gspread.exceptions.SpreadsheetNotFound as e:
+        raise RuntimeError(f"Spreadsheet with ID '{SPREADSHEET_ID}' not found or permission issue.") from e
+    except Exception as e:
+        raise RuntimeError(f"An unexpected error occurred: {e}") from e
 
-        with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(all_values, f, ensure_ascii=False, indent=4)
-        # print(f"fetch_data.py: Data successfully fetched and saved to {OUTPUT_FILE}")
-        sys.stdout.write(f"Data successfully fetched and saved to {OUTPUT_FILE}\n")
-        sys.exit(0)
-        
-    except FileNotFoundError:
-        sys.stderr.write(f"fetch_data.py: Error: Credentials file not found at {CREDENTIALS_FILE}\n")
-        sys.exit(1)
-    except gspread.exceptions.SpreadsheetNotFound:
-        sys.stderr.write(f"fetch_data.py: Error: Spreadsheet with ID '{SPREADSHEET_ID}' not found or permission issue.\n")
-        sys.exit(1)
+def fetch_and_save_data():
+    """
+    Command-line entry point: fetches all sheet data and writes it to stdout as JSON,
+    so a parent process can read it from the pipe without a temporary file.
+    Status and error messages go to stderr, keeping stdout pure JSON.
+    Exits with 0 on success, 1 on failure.
+    """
+    try:
+        all_values = fetch_sheet_values(max_rows=None)
     except Exception as e:
-        sys.stderr.write(f"fetch_data.py: An unexpected error occurred: {e}\n")
+        sys.stderr.write(f"fetch_data.py: Error: {e}\n")
         sys.exit(1)
+    if orjson:
+        sys.stdout.buffer.write(orjson.dumps(all_values)) # UTF-8 bytes, non-ASCII kept as is
+    else:
+        sys.stdout.write(json.dumps(all_values, ensure_ascii=False, separators=(',', ':'))) # Compact, nobody reads it
+    sys.stderr.write(f"Data successfully fetched: {len(all_values)} rows\n")
+    sys.exit(0)
 
 if __name__ == '__main__':
     fetch_and_save_data() 
\ No newline at end of file
@@ -1,26 +1,33 @@
 import streamlit as st
-import subprocess
-import json
-import os
-import sys # For sys.executable, though we might not need it if "python" in subprocess works
+import pandas as pd
+import asyncio
+import sys
+import threading
+from fetch_data import fetch_sheet_values
 
 # Attempt to import AI processor components
 try:
-    from ai_processor import get_ai_response, google_api_key_loaded, gemini_model
+    from ai_processor import (
+        get_ai_response, get_ai_responses_batch, google_api_key_loaded, gemini_model,
+        cache_stats, prefetch_question_embedding
+    )
     ai_module_loaded = True
 except ImportError as e:
     ai_module_loaded = False
     ai_import_error = str(e)
     # These will be used to display an error if import fails
     get_ai_response = None
+    get_ai_responses_batch = None
     google_api_key_loaded = False
     gemini_model = None
+    cache_stats = None
+    prefetch_question_embedding = None
 
 
 st.set_page_config(page_title="Data Dashboard MVP", layout="wide") # Added page config
 st.title("MVP de Monitorización de Bienestar para Adultos Mayores")
 
-DATA_FILE_PATH = 'temp_sheet_data.json'
+PREVIEW_PAGE_ROWS = 200 # Data rows fetched per "load more" step for the preview
 
 # Initialize session state variables
 if 'sheet_data' not in st.session_state:
@@ -31,6 +38,66 @@ if 'user_question' not in st.session_state:
     st.session_state.user_question = ""
 if 'ai_response' not in st.session_state:
     st.session_state.ai_response = None
+if 'batch_questions' not in st.session_state:
+    st.session_state.batch_questions = ""
+if 'force_refresh' not in st.session_state:
+    st.session_state.force_refresh = False
+if 'preview_rows' not in st.session_state:
+    st.session_state.preview_rows = PREVIEW_PAGE_ROWS
+if 'load_more_requested' not in st.session_state:
+    st.session_state.load_more_requested = False
+
+
+def request_more_rows():
+    """Callback for the load-more button: fetch the next page of rows on this rerun."""
+    st.session_state.preview_rows += PREVIEW_PAGE_ROWS
+    st.session_state.load_more_requested = True
+
+
+def warm_up_question():
+    """Callback for the question box: embed the new question in the background before it is analyzed."""
+    question = st.session_state.question_input
+    if prefetch_question_embedding and question.strip():
+        threading.Thread(target=prefetch_question_embedding, args=(question,), daemon=True).start()
+
+
+def render_data_preview():
+    """Shows the loaded sheet rows as a scrollable table, with a load-more button when the sheet may have more rows."""
+    st.write("**Data Preview:**")
+    data_to_display = st.session_state.sheet_data # Use all loaded data
+
+    if data_to_display and isinstance(data_to_display, list) and len(data_to_display) > 0 and isinstance(data_to_display[0], list):
+        num_data_rows = len(data_to_display) - 1 if len(data_to_display) > 0 else 0
+        num_cols = len(data_to_display[0]) if num_data_rows >= 0 and data_to_display[0] else 0 # Handle empty data_to_display[0]
+        st.caption(f"Showing all {num_data_rows} loaded data rows and {num_cols} columns. Table is scrollable.")
+
+        try:
+            # Rows come back without trailing empty cells: pad them to the header width, drop cells past it
+            preview_rows = [row[:num_cols] + [""] * (num_cols - len(row)) for row in data_to_display[1:]]
+            preview_df = pd.DataFrame(preview_rows, columns=data_to_display[0])
+            st.dataframe(preview_df, height=400, use_container_width=True)
+        except Exception as e:
+            st.error(f"Error formatting preview: {str(e)}")
+            st.json(data_to_display) # Show all data if formatting fails
+        if num_data_rows >= st.session_state.preview_rows: # The sheet may have more rows
+            st.button("⬇️ Cargar más filas", on_click=request_more_rows)
+    elif data_to_display: # Handles cases like empty list or not list of lists after header check
+        st.write("Preview data is empty or not in the expected format (list of lists).")
+        st.json(data_to_display)
+
+
+async def fetch_async(max_rows):
+    """Runs the blocking sheet fetch in a worker thread."""
+    return await asyncio.to_thread(fetch_sheet_values, max_rows)
+
+
+async def load_data_and_warm_up(question, max_rows):
+    """Fetches the sheet while the question is embedded for the semantic cache; returns the sheet rows."""
+    tasks = [fetch_async(max_rows)]
+    if prefetch_question_embedding:
+        tasks.append(asyncio.to_thread(prefetch_question_embedding, question))
+    results = await asyncio.gather(*tasks)
+    return results[0]
 
 
 # --- Sidebar for AI Status ---
@@ -45,6 +112,9 @@ with st.sidebar:
         st.success(f"✅ Gemini Model Initialized ({gemini_model.model_name})")
     else:
         st.warning("AI module loaded, but Gemini model not available.")
+    if cache_stats:
+        stats = cache_stats()
+        st.caption(f"Response cache: {stats['hits']} hits / {stats['misses']} misses")
 
 
 # --- Main App Layout ---
@@ -52,82 +122,27 @@ with st.sidebar:
 
 # Section 1: Load Survey Data (will take full width)
 st.subheader("1. Cargar Datos de Encuestas") # Translated subheader
-if st.button("🔄 Cargar datos de encuestas"):
+load_more_requested = st.session_state.load_more_requested
+st.session_state.load_more_requested = False
+if st.button("🔄 Cargar datos de encuestas") or load_more_requested:
+    if not load_more_requested:
+        st.session_state.preview_rows = PREVIEW_PAGE_ROWS
     st.session_state.sheet_data = None 
     st.session_state.error_message = None
     st.session_state.ai_response = None # Clear AI response when reloading data
-    with st.spinner("Ejecutando script para cargar datos..."):
+    with st.spinner("Cargando datos de la hoja..."):
         try:
-            python_executable = sys.executable # More robust way to get current venv python
-            process = subprocess.run(
-                [python_executable, "fetch_data.py"], 
-                capture_output=True, text=True, check=False, encoding='utf-8'
-            )
-            if process.returncode == 0:
-                st.success(f"Sheet data script success: {process.stdout.strip()}")
-                if os.path.exists(DATA_FILE_PATH):
-                    try:
-                        with open(DATA_FILE_PATH, 'r', encoding='utf-8') as f:
-                            st.session_state.sheet_data = json.load(f)
-                    except json.JSONDecodeError as json_err:
-                        st.session_state.error_message = f"Error decoding JSON: {json_err}"
-                    except Exception as file_err:
-                        st.session_state.error_message = f"Error reading data file: {file_err}"
-                else:
-                    st.session_state.error_message = f"Data file not found. Script stdout: {process.stdout.strip()}, stderr: {process.stderr.strip()}"
-            else:
-                st.session_state.error_message = f"Sheet data script failed (Code {process.returncode}):\nSTDOUT:{process.stdout.strip()}\nSTDERR:{process.stderr.strip()}"
-        except FileNotFoundError:
-            st.session_state.error_message = f"Error: Command '{python_executable}' or 'fetch_data.py' not found."
+            # Only fetch the rows the preview shows (plus the header), not the whole sheet
+            st.session_state.sheet_data = fetch_sheet_values(max_rows=st.session_state.preview_rows + 1)
+            st.success(f"Sheet data loaded: {len(st.session_state.sheet_data)} rows.")
         except Exception as e:
-            st.session_state.error_message = f"Unexpected error running script: {str(e)}"
+            st.session_state.error_message = f"Error loading sheet data: {str(e)}"
 
     if st.session_state.error_message:
         st.error(st.session_state.error_message)
 
     if st.session_state.sheet_data:
-        st.write("**Data Preview:**")
-        data_to_display = st.session_state.sheet_data # Use all loaded data
-
-        if data_to_display and isinstance(data_to_display, list) and len(data_to_display) > 0 and isinstance(data_to_display[0], list):
-            num_data_rows = len(data_to_display) - 1 if len(data_to_display) > 0 else 0
-            num_cols = len(data_to_display[0]) if num_data_rows >= 0 and data_to_display[0] else 0 # Handle empty data_to_display[0]
-            st.caption(f"Showing all {num_data_rows} loaded data rows and {num_cols} columns. Table is scrollable.")
-
-            try:
-                html_table_string = "<table border='1' style='border-collapse: collapse;'>" # Removed width: 100%
-                
-                # Prepare header
-                if data_to_display[0]: # Ensure header row exists
-                    html_table_string += "<thead><tr>"
-                    for h_item in data_to_display[0]:
-                        html_table_string += f"<th style='padding: 5px; text-align: left; border: 1px solid #ddd; white-space: nowrap;'>{str(h_item)}</th>" # Added white-space: nowrap
-                    html_table_string += "</tr></thead>"
-                
-                # Prepare data rows
-                html_table_string += "<tbody>"
-                for original_row in data_to_display[1:]:
-                    html_table_string += "<tr>"
-                    # Ensure consistent number of cells as in header
-                    # Pad with empty cells if row is shorter
-                    num_header_cols = len(data_to_display[0]) if data_to_display[0] else 0
-                    for i in range(num_header_cols):
-                        cell_value = str(original_row[i]) if i < len(original_row) else "" # Handle rows shorter than header
-                        html_table_string += f"<td style='padding: 5px; border: 1px solid #ddd; white-space: nowrap;'>{cell_value}</td>" # Added white-space: nowrap
-                    html_table_string += "</tr>"
-                html_table_string += "</tbody></table>"
-                    
-                # Wrap HTML table string in a scrollable div
-                scrollable_div_html = f"<div style='overflow-x: auto; width: 100%; max-height: 400px; border: 1px solid #eee; padding: 5px;'>{html_table_string}</div>"
-                st.markdown(scrollable_div_html, unsafe_allow_html=True)
-            except Exception as e:
-                st.error(f"Error formatting preview: {str(e)}")
-                st.json(data_to_display) # Show all data if formatting fails
-        elif data_to_display: # Handles cases like empty list or not list of lists after header check
-            st.write("Preview data is empty or not in the expected format (list of lists).")
-            st.json(data_to_display)
-        # else: # No explicit message if no data and no error, button prompts action
-            # if not st.session_state.error_message: st.info("Data loaded is empty.")
+        render_data_preview()
 
 # Section 2: Ask AI About Data (will take full width, below Section 1)
 st.subheader("2. Consultar a la IA sobre los Datos") # Translated subheader
@@ -137,32 +152,101 @@ st.session_state.user_question = st.text_area(
     "Formule su pregunta en español:", 
     value=st.session_state.user_question,
     height=100,
-    placeholder="Ej: ¿Cuál es el estado de ánimo general reportado?"
+    placeholder="Ej: ¿Cuál es el estado de ánimo general reportado?",
+    key="question_input",
+    on_change=warm_up_question
+)
+st.session_state.force_refresh = st.checkbox(
+    "🔄 Ignorar caché",
+    value=st.session_state.force_refresh,
+    help="Vuelve a consultar a la IA aunque la pregunta ya tenga una respuesta guardada."
+)
+
+analyze_clicked = st.button("🔍 Analizar con IA")
+load_and_analyze_clicked = st.button(
+    "🚀 Cargar y analizar",
+    help="Carga los datos de la hoja y prepara la IA en paralelo, y luego analiza la pregunta."
 )
 
-if st.button("🔍 Analizar con IA"):
+load_failed = False
+if load_and_analyze_clicked and st.session_state.user_question.strip():
+    st.session_state.error_message = None
+    st.session_state.preview_rows = PREVIEW_PAGE_ROWS
+    with st.spinner("Cargando datos y preparando la IA..."):
+        try:
+            # Overlap the Sheets API round-trip with loading the embedding model and embedding the question
+            st.session_state.sheet_data = asyncio.run(load_data_and_warm_up(
+                st.session_state.user_question,
+                st.session_state.preview_rows + 1
+            ))
+            st.success(f"Sheet data loaded: {len(st.session_state.sheet_data)} rows.")
+        except Exception as e:
+            load_failed = True
+            st.session_state.sheet_data = None
+            st.session_state.error_message = f"Error loading sheet data: {str(e)}"
+            st.error(st.session_state.error_message)
+    if st.session_state.sheet_data:
+        render_data_preview()
+
+if (analyze_clicked or load_and_analyze_clicked) and not load_failed: # The load error above already explains why nothing was analyzed
     st.session_state.ai_response = None # Clear previous AI response
     if not ai_module_loaded:
         st.error(f"AI module not loaded. Cannot analyze. Error: {ai_import_error}")
     elif not google_api_key_loaded or not gemini_model:
         st.error("AI not initialized. Check API key and AI status in sidebar.")
+    elif not st.session_state.user_question.strip(): # Checked first: "Cargar y analizar" skips loading without a question
+        st.warning("Por favor, formule una pregunta.")
     elif not st.session_state.sheet_data:
         st.warning("Por favor, cargue los datos primero.")
-    elif not st.session_state.user_question.strip():
-        st.warning("Por favor, formule una pregunta.")
     else:
+        st.write("**Respuesta de la IA:**")
         with st.spinner("Procesando con IA..."):
             try:
-                st.session_state.ai_response = get_ai_response(
+                # Render chunks as they arrive instead of waiting for the full answer
+                st.session_state.ai_response = st.write_stream(get_ai_response(
                     st.session_state.user_question, 
-                    st.session_state.sheet_data
-                )
+                    st.session_state.sheet_data,
+                    force_refresh=st.session_state.force_refresh
+                ))
             except Exception as e:
                 st.session_state.ai_response = f"Error durante el análisis con IA: {str(e)}"
-    
-    if st.session_state.ai_response:
-        st.write("**Respuesta de la IA:**")
-        st.markdown(st.session_state.ai_response) # Use markdown to render AI response nicely
+                st.markdown(st.session_state.ai_response)
+
+# Section 3: Ask several questions at once
+st.subheader("3. Consultar Varias Preguntas")
+
+st.session_state.batch_questions = st.text_area(
+    "Una pregunta por línea:",
+    value=st.session_state.batch_questions,
+    height=150,
+    placeholder="Ej:\n¿Cuál es el estado de ánimo general?\n¿Qué problemas hubo con los servicios municipales?"
+)
+
+if st.button("📋 Analizar varias preguntas"):
+    batch_questions = [q.strip() for q in st.session_state.batch_questions.splitlines() if q.strip()]
+    if not ai_module_loaded:
+        st.error(f"AI module not loaded. Cannot analyze. Error: {ai_import_error}")
+    elif not google_api_key_loaded or not gemini_model:
+        st.error("AI not initialized. Check API key and AI status in sidebar.")
+    elif not st.session_state.sheet_data:
+        st.warning("Por favor, cargue los datos primero.")
+    elif not batch_questions:
+        st.warning("Por favor, formule al menos una pregunta.")
+    else:
+        with st.spinner(f"Procesando {len(batch_questions)} preguntas con IA..."):
+            try:
+                batch_responses = get_ai_responses_batch(
+                    batch_questions,
+                    st.session_state.sheet_data,
+                    force_refresh=st.session_state.force_refresh
+                )
+            except Exception as e:
+                batch_responses = None
+                st.error(f"Error durante el análisis con IA: {str(e)}")
+        if batch_responses:
+            for i, (question, response) in enumerate(zip(batch_questions, batch_responses), start=1):
+                st.markdown(f"**{i}. {question}**")
+                st.markdown(response)
 
 st.markdown("---")
 st.caption(f"Streamlit {st.__version__} in `venv_clean` | Python {sys.version.split()[0]}")
\ No newline at end of file